@@ -0,0 +1,43 @@
+"""Reports clusters of near-duplicate questions in the database.
+
+Usage:
+  python find_duplicates.py [threshold]
+"""
+import sys
+
+import flask as fsk
+import models
+from flaskr.similarity import DUPLICATE_THRESHOLD, SimilarityIndex
+
+
+def find_duplicates(threshold=DUPLICATE_THRESHOLD):
+    """Returns near-duplicate clusters as lists of formatted questions."""
+    query = models.Question.query.with_entities(
+        models.Question.id, models.Question.question, models.Question.answer)
+    index = SimilarityIndex()
+    index.load(query)
+
+    clusters = []
+    for qids in index.clusters(threshold):
+        qs = (models.Question.query
+                    .filter(models.Question.id.in_(qids))
+                    .order_by(models.Question.id))
+        clusters.append([q.format() for q in qs])
+    return clusters
+
+
+if __name__ == "__main__":
+    threshold = DUPLICATE_THRESHOLD
+    if len(sys.argv) > 1:
+        threshold = float(sys.argv[1])
+
+    app = fsk.Flask(__name__)
+    models.setup_db(app)
+    with app.app_context():
+        clusters = find_duplicates(threshold)
+
+    for i, cluster in enumerate(clusters, 1):
+        print(f"Cluster {i}:")
+        for q in cluster:
+            print(f"  [{q['id']}] {q['question']} -- {q['answer']}")
+    print(f"{len(clusters)} near-duplicate cluster(s) found.")
@@ -1,10 +1,20 @@
 import logging
-import random
+import time
 import flask as fsk
 import flask_cors as fc
+from werkzeug.middleware.proxy_fix import ProxyFix
 import models
+from flaskr.admission import (AdmissionController, CLIENT_BURST,
+                              CLIENT_RATE, DEFAULT_MAX_OVERFLOW,
+                              DEFAULT_POOL_SIZE, MAX_CLIENTS)
+from flaskr.buckets import QuestionBuckets
+from flaskr.similarity import SimilarityIndex
 
 QUESTIONS_PER_PAGE = 10
+QUIZ_RAMP_STEP = 2  # Questions answered per difficulty step in ramped quizzes
+
+# Endpoints that may scan the whole `questions` table
+SCAN_ENDPOINTS = {"search_questions", "get_questions_by_category"}
 
 
 def valid_and_cast(data, types, optional=None, cast=True):
@@ -14,7 +24,8 @@ def valid_and_cast(data, types, optional=None, cast=True):
       data: (dict) Data to be type-checked
       types: (dict) Type map of each element in `data`
       optional: (set) Optional keys
-      cast: (bool) If True, cast the element before type-check
+      cast: (bool) If True, cast the element before type-check.
+        Booleans are never casted, since e.g. `bool("false")` is True.
 
     Returns:
       A shallow copy of `data`, with values casted if applicable.
@@ -32,7 +43,7 @@ def valid_and_cast(data, types, optional=None, cast=True):
     for k, t in types.items():
         if k in data:
             v = data[k]
-            if v is not None and cast:
+            if v is not None and cast and t is not bool:
                 try:
                     v = t(v)
                 except BaseException:
@@ -44,13 +55,32 @@ def valid_and_cast(data, types, optional=None, cast=True):
     return out
 
 
-def error_json(code, message):
-    return fsk.jsonify({"success": False, "error": code, "message": message})
+def error_json(code, message, **extra):
+    return fsk.jsonify(
+        {"success": False, "error": code, "message": message, **extra})
+
+
+def is_expensive(request):
+    """Checks if a request may scan the whole `questions` table.
+
+    Unpaginated listings and searches are expensive; everything else,
+    including quizzes served from in-memory buckets, is cheap.
+    """
+    if request.endpoint not in SCAN_ENDPOINTS:
+        return False
+    if request.args.get("search"):
+        return True
+    try:
+        return int(request.args.get("page", 0)) <= 0
+    except BaseException:
+        return True
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = fsk.Flask(__name__)
+    if test_config:
+        app.config.update(test_config)
     models.setup_db(app)
 
     # Set up CORS.
@@ -65,6 +95,90 @@ def create_app(test_config=None):
         response.headers.add("Access-Control-Allow-Methods", "GET,POST,DELETE")
         return response
 
+    #   Admission control: shed load before it reaches the database.
+    #   The in-flight limit matches the connection pool size by default.
+    #   Any controller argument can be overridden with an `ADMISSION_*`
+    #   config key, e.g. `ADMISSION_CLIENT_RATE`.
+    #   Clients are keyed by IP address. Behind reverse proxies, set
+    #   `TRUSTED_PROXIES` to their number so that the address is taken
+    #   from `X-Forwarded-For`.
+    cfg = app.config
+    if cfg.get("TRUSTED_PROXIES"):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=cfg["TRUSTED_PROXIES"])
+
+    pool_size = cfg.get("SQLALCHEMY_POOL_SIZE") or DEFAULT_POOL_SIZE
+    max_overflow = cfg.get("SQLALCHEMY_MAX_OVERFLOW") or DEFAULT_MAX_OVERFLOW
+    admission = AdmissionController(
+        cfg.get("ADMISSION_LIMIT", pool_size + max_overflow),
+        expensive_limit=cfg.get("ADMISSION_EXPENSIVE_LIMIT", pool_size),
+        rate=cfg.get("ADMISSION_CLIENT_RATE", CLIENT_RATE),
+        burst=cfg.get("ADMISSION_CLIENT_BURST", CLIENT_BURST),
+        max_clients=cfg.get("ADMISSION_MAX_CLIENTS", MAX_CLIENTS),
+        clock=cfg.get("ADMISSION_CLOCK", time.monotonic))
+
+    @app.before_request
+    def admit_request():
+        if fsk.request.method == "OPTIONS":
+            return None
+
+        expensive = is_expensive(fsk.request)
+        rejected = admission.admit(fsk.request.remote_addr, expensive)
+        if rejected is not None:
+            code, retry_after = rejected
+            message = ("too many requests" if code == 429
+                       else "service unavailable")
+            response = error_json(code, message)
+            response.headers["Retry-After"] = str(retry_after)
+            return response, code
+
+        fsk.g.admitted_expensive = expensive
+        return None
+
+    @app.teardown_request
+    def release_request(exc):
+        expensive = fsk.g.pop("admitted_expensive", None)
+        if expensive is not None:
+            admission.release(expensive)
+
+    #   Question IDs by (category, difficulty) for quiz sampling.
+    #   Loaded from the database on first use and kept in sync by the
+    #   create & delete endpoints. The buckets are per process, so they are
+    #   reloaded whenever the table's row count or max ID no longer matches,
+    #   i.e. questions were added or deleted elsewhere (other workers, direct
+    #   database edits).
+    buckets = QuestionBuckets()
+
+    def table_version():
+        db = models.db
+        return tuple(db.session.query(
+            db.func.count(models.Question.id),
+            db.func.max(models.Question.id)).one())
+
+    def get_buckets():
+        version = table_version()
+        if buckets.version != version:
+            rows = models.Question.query.with_entities(
+                models.Question.id,
+                models.Question.category,
+                models.Question.difficulty)
+            buckets.load(rows, version)
+        return buckets
+
+    #   MinHash/LSH index over question & answer text for near-duplicate
+    #   detection. Loaded, kept in sync and reloaded the same way as
+    #   `buckets`.
+    sim_index = SimilarityIndex()
+
+    def get_sim_index():
+        version = table_version()
+        if sim_index.version != version:
+            rows = models.Question.query.with_entities(
+                models.Question.id,
+                models.Question.question,
+                models.Question.answer)
+            sim_index.load(rows, version)
+        return sim_index
+
     # Create an endpoint to handle GET requests for all available categories.
     @app.route("/categories", methods=["GET"])
     @fc.cross_origin()
@@ -143,6 +257,9 @@ def create_app(test_config=None):
 
     #   Create an endpoint to POST a new question, which will require the
     #   question and answer text, category ID, and difficulty score (+ve int).
+    #   Near-duplicates of existing questions are rejected with status 409
+    #   and their IDs; if `allow_duplicate` is set, the question is created
+    #   and the IDs are returned as a flag instead.
     @app.route("/questions", methods=["POST"])
     @fc.cross_origin()
     def create_question():
@@ -154,15 +271,25 @@ def create_app(test_config=None):
             "answer": str,
             "category": int,
             "difficulty": int,
+            "allow_duplicate": bool,
         }
 
-        data = valid_and_cast(data, types)
+        data = valid_and_cast(data, types, optional={"allow_duplicate"})
+        allow_duplicate = data.pop("allow_duplicate", False)
 
         # Sanity-check
         cid = data["category"]
         if models.Category.query.get(cid) is None or data["difficulty"] < 1:
             fsk.abort(422)
 
+        # Duplicate-check
+        dups = [d for d, _ in get_sim_index().query(
+            data["question"], data["answer"])]
+        if dups and not allow_duplicate:
+            logging.info(
+                f"Rejected near-duplicate of questions {dups}: {data}")
+            return error_json(409, "conflict", duplicates=dups), 409
+
         # Create question
         qtn = models.Question(**data)
         db = models.db
@@ -170,7 +297,6 @@ def create_app(test_config=None):
             qtn.insert()
             q_data = qtn.format()
             logging.info(f"Created question: {q_data}")
-            return fsk.jsonify({"success": True, "id": q_data["id"]})
         except BaseException:
             db.session.rollback()
             logging.exception(
@@ -179,6 +305,16 @@ def create_app(test_config=None):
         finally:
             db.session.close()
 
+        # Update indexes once committed
+        get_buckets().add(
+            q_data["id"], q_data["category"], q_data["difficulty"])
+        get_sim_index().add(q_data["id"], q_data["question"], q_data["answer"])
+
+        res = {"success": True, "id": q_data["id"]}
+        if allow_duplicate:
+            res["duplicates"] = dups
+        return fsk.jsonify(res)
+
     # Create an endpoint to get question by ID.
     @app.route("/questions/<int:qid>", methods=["GET"])
     @fc.cross_origin()
@@ -210,43 +346,85 @@ def create_app(test_config=None):
         finally:
             db.session.close()
 
+        # Update indexes once committed
+        get_buckets().remove(q_data["id"])
+        get_sim_index().remove(q_data["id"])
+
         return fsk.jsonify({"success": True, "id": q_data["id"]})
 
     #   Create a POST endpoint to get questions to play the quiz.
     #   This endpoint takes category and previous question parameters
     #   and return a random questions within the given category,
     #   if provided, and that is not one of the previous questions.
+    #   Questions can optionally be limited to a difficulty range, and with
+    #   `ramp` set, difficulty rises as more questions are answered.
     @app.route("/quizzes", methods=["POST"])
     @fc.cross_origin()
     def get_quiz_question():
         data = fsk.request.get_json()
 
         # Type-check
-        data = valid_and_cast(data, {"previous_questions": list,
-                                     "quiz_category": int})
+        types = {
+            "previous_questions": list,
+            "quiz_category": int,
+            "min_difficulty": int,
+            "max_difficulty": int,
+            "ramp": bool,
+        }
+        data = valid_and_cast(
+            data, types, optional={"min_difficulty", "max_difficulty", "ramp"})
 
         # Sanity-check
         pqids = data["previous_questions"]
         cid = data["quiz_category"]
         try:
-            pqids = [int(qid) for qid in pqids]
+            pqids = {int(qid) for qid in pqids}
         except BaseException:
             fsk.abort(422)
 
-        # Get questions IDs with previous ones excluded
-        query = (models.Question
-                       .query.with_entities(models.Question.id)
-                       .filter(~models.Question.id.in_(pqids)))
-        if cid != 0:
-            query = query.filter(models.Question.category == cid)
-        qids = [q.id for q in query]
+        lo = data.get("min_difficulty")
+        hi = data.get("max_difficulty")
+        if ((lo is not None and lo < 1) or (hi is not None and hi < 1)
+                or (lo is not None and hi is not None and lo > hi)):
+            fsk.abort(422)
 
+        def sample(bkts, exclude):
+            if lo is None and hi is None and not data.get("ramp"):
+                # Any question, including ones without a difficulty
+                return bkts.sample(cid, None, exclude)
+
+            # Difficulties within range
+            levels = [d for d in bkts.difficulties(cid)
+                      if (lo is None or d >= lo) and (hi is None or d <= hi)]
+            if not levels:
+                return None
+            if not data.get("ramp"):
+                return bkts.sample(cid, set(levels), exclude)
+
+            # Start from the target level and move outwards, harder first.
+            step = min(len(pqids) // QUIZ_RAMP_STEP, len(levels) - 1)
+            order = sorted(range(len(levels)),
+                           key=lambda i: (abs(i - step), -i))
+            for i in order:
+                qid = bkts.sample(cid, {levels[i]}, exclude)
+                if qid is not None:
+                    return qid
+            return None
+
+        bkts = get_buckets()
+        exclude = set(pqids)
         q = None
-        if qids:
-            # Choose question randomly
-            qid = qids[random.randint(0, len(qids) - 1)]
-            q = models.Question.query.get(qid).format()  # Get chosen question
-        return fsk.jsonify({"success": True, "question": q})
+        while q is None:
+            qid = sample(bkts, exclude)
+            if qid is None:
+                break
+            q = models.Question.query.get(qid)  # Get chosen question
+            if q is None:
+                # Deleted since the version check; drop the stale ID.
+                bkts.remove(qid)
+                exclude.add(qid)
+
+        return fsk.jsonify({"success": True, "question": q and q.format()})
 
     # Create error handler for status 400
     @app.errorhandler(400)
@@ -0,0 +1,109 @@
+import collections
+import math
+import threading
+import time
+
+CLIENT_RATE = 10.0    # Tokens refilled per second for each client
+CLIENT_BURST = 20.0   # Maximum tokens held by each client
+EXPENSIVE_COST = 5.0  # Tokens taken by an expensive request (cheap ones: 1)
+MAX_CLIENTS = 10000   # Client buckets kept; least recently used are evicted
+
+# Fallbacks for the in-flight limit, mirroring the SQLAlchemy engine's
+# QueuePool defaults (pool_size=5, max_overflow=10) used when the app does
+# not configure SQLALCHEMY_POOL_SIZE / SQLALCHEMY_MAX_OVERFLOW.
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` up to `burst` tokens."""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, cost, now):
+        """Takes `cost` tokens.
+
+        Returns:
+          0 on success, otherwise seconds until enough tokens are available.
+        """
+        self.refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Per-client rate limiting plus a global limit on in-flight requests.
+
+    The in-flight limit should match the number of database connections, so
+    that requests are shed up front rather than queueing on the pool.
+    Expensive requests may only take up to `expensive_limit` of the slots,
+    which keeps the rest free for cheap requests. At most `max_clients` client
+    buckets are kept, evicting the least recently used.
+    """
+
+    def __init__(self, limit, expensive_limit=None, rate=CLIENT_RATE,
+                 burst=CLIENT_BURST, max_clients=MAX_CLIENTS,
+                 clock=time.monotonic):
+        self.limit = limit
+        self.expensive_limit = (max(limit // 2, 1) if expensive_limit is None
+                                else expensive_limit)
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._clients = collections.OrderedDict()  # client key -> TokenBucket
+        self._in_flight = 0
+        self._expensive_in_flight = 0
+
+    def admit(self, client, expensive=False):
+        """Tries to admit a request.
+
+        Args:
+          client: (str) Key identifying the client
+          expensive: (bool) Whether the request is expensive
+
+        Returns:
+          None if admitted, otherwise a (status code, Retry-After seconds)
+          pair. An admitted request must be followed by `release()`.
+        """
+        now = self.clock()
+        with self._lock:
+            if self._in_flight >= self.limit or (
+                    expensive
+                    and self._expensive_in_flight >= self.expensive_limit):
+                return 503, 1
+
+            bucket = self._clients.get(client)
+            if bucket is None:
+                if len(self._clients) >= self.max_clients:
+                    self._clients.popitem(last=False)
+                bucket = self._clients[client] = TokenBucket(
+                    self.rate, self.burst, now)
+            else:
+                self._clients.move_to_end(client)
+            wait = bucket.take(EXPENSIVE_COST if expensive else 1, now)
+            if wait:
+                return 429, max(math.ceil(wait), 1)
+
+            self._in_flight += 1
+            if expensive:
+                self._expensive_in_flight += 1
+        return None
+
+    def release(self, expensive=False):
+        with self._lock:
+            self._in_flight -= 1
+            if expensive:
+                self._expensive_in_flight -= 1
@@ -0,0 +1,113 @@
+import random
+import threading
+
+
+class QuestionBuckets:
+    """Question IDs grouped by (category, difficulty) for quiz sampling.
+
+    Each bucket keeps its IDs in a list together with an ID-to-position map,
+    so that IDs can be added, removed and sampled in O(1). The buckets are
+    built from the `questions` table and then kept up to date by the create &
+    delete endpoints.
+
+    `version` is the (row count, max ID) of the table the buckets reflect,
+    adjusted on each add & remove, so that changes made elsewhere can be
+    detected by comparing it with the table.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}    # (category, difficulty) -> [question ID]
+        self._positions = {}  # question ID -> ((category, difficulty), index)
+        self.version = None   # (row count, max ID), None until loaded
+
+    def load(self, rows, version):
+        """Rebuilds all buckets from (id, category, difficulty) rows."""
+        with self._lock:
+            self._buckets = {}
+            self._positions = {}
+            for qid, cid, difficulty in rows:
+                self._add(qid, cid, difficulty)
+            self.version = version
+
+    def add(self, qid, cid, difficulty):
+        with self._lock:
+            if self.version is not None and qid not in self._positions:
+                count, max_id = self.version
+                self.version = (count + 1, max(max_id or 0, qid))
+            self._add(qid, cid, difficulty)
+
+    def remove(self, qid):
+        with self._lock:
+            if self.version is not None and qid in self._positions:
+                count, max_id = self.version
+                self.version = (count - 1, max_id)
+            self._remove(qid)
+
+    def _add(self, qid, cid, difficulty):
+        if qid in self._positions:
+            self._remove(qid)
+        key = (cid, difficulty)
+        bucket = self._buckets.setdefault(key, [])
+        self._positions[qid] = (key, len(bucket))
+        bucket.append(qid)
+
+    def _remove(self, qid):
+        pos = self._positions.pop(qid, None)
+        if pos is None:
+            return
+        key, i = pos
+
+        # Swap with the last element and pop.
+        bucket = self._buckets[key]
+        last = bucket.pop()
+        if last != qid:
+            bucket[i] = last
+            self._positions[last] = (key, i)
+        if not bucket:
+            del self._buckets[key]
+
+    def sample(self, cid=0, difficulties=None, exclude=(), tries=16):
+        """Picks a random question ID not in `exclude`.
+
+        Args:
+          cid: (int) Category ID, 0 for all categories
+          difficulties: (set) Allowed difficulties, None for all
+          exclude: (set) Question IDs not to be chosen
+          tries: (int) Random draws before falling back to a full scan
+
+        Returns:
+          A question ID, or None if no eligible question is left.
+        """
+        with self._lock:
+            buckets = [b for (c, d), b in self._buckets.items()
+                       if (cid == 0 or c == cid)
+                       and (difficulties is None or d in difficulties)]
+            total = sum(len(b) for b in buckets)
+            if total == 0:
+                return None
+
+            # Draw uniformly across the eligible buckets; excluded IDs are
+            # usually a small share of them, so this rarely needs a retry.
+            for _ in range(tries):
+                i = random.randrange(total)
+                for b in buckets:
+                    if i < len(b):
+                        qid = b[i]
+                        break
+                    i -= len(b)
+                if qid not in exclude:
+                    return qid
+
+            # Most of the eligible questions are excluded.
+            qids = [qid for b in buckets for qid in b if qid not in exclude]
+            return random.choice(qids) if qids else None
+
+    def difficulties(self, cid=0):
+        """Returns the sorted difficulties available in a category.
+
+        Questions without a difficulty are left out.
+        """
+        with self._lock:
+            return sorted({d for c, d in self._buckets
+                           if (cid == 0 or c == cid) and d is not None})
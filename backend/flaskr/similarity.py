@@ -0,0 +1,183 @@
+import random
+import re
+import threading
+import zlib
+
+NUM_PERM = 64         # MinHash signature length
+NUM_BANDS = 16        # LSH bands, each NUM_PERM // NUM_BANDS rows long
+SHINGLE_SIZE = 3      # Characters per shingle
+DUPLICATE_THRESHOLD = 0.7  # Estimated Jaccard similarity of questions
+ANSWER_THRESHOLD = 0.5     # Jaccard similarity of answer words
+ANSWER_STOPWORDS = {"a", "an", "the"}
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME))
+          for _ in range(NUM_PERM)]
+
+
+def normalize(text):
+    """Lower-cases, strips punctuation and collapses spaces of a text.
+
+    A missing (None) text is treated as empty.
+    """
+    text = re.sub(r"[^\w\s]", " ", (text or "").lower())
+    return " ".join(text.split())
+
+
+def signature(question):
+    """Computes the MinHash signature of a question."""
+    text = normalize(question)
+    n = max(len(text) - SHINGLE_SIZE + 1, 1)
+    shingles = {zlib.crc32(text[i:i + SHINGLE_SIZE].encode())
+                for i in range(n)}
+    return tuple(min((a * s + b) % _PRIME for s in shingles)
+                 for a, b in _PERMS)
+
+
+def similarity(sig1, sig2):
+    """Estimates the Jaccard similarity between two signatures."""
+    return sum(x == y for x, y in zip(sig1, sig2)) / NUM_PERM
+
+
+def answer_words(answer):
+    """Returns the set of words in an answer, ignoring articles."""
+    return set(normalize(answer).split()) - ANSWER_STOPWORDS
+
+
+def answer_similarity(words1, words2):
+    """Computes the Jaccard similarity between two answers' words."""
+    if not words1 or not words2:
+        return float(words1 == words2)
+    return len(words1 & words2) / len(words1 | words2)
+
+
+class SimilarityIndex:
+    """MinHash/LSH index over question text, with answers checked separately.
+
+    Signatures are split into bands, and questions sharing any band are
+    candidate near-duplicates. Only the candidates are compared, so a lookup
+    does not scan the whole `questions` table. A candidate is a near-duplicate
+    if both its question and its answer are similar enough, so that questions
+    with a similar stem but a different answer are kept apart. The index is
+    built from the table and then kept up to date by the create & delete
+    endpoints.
+
+    `version` is the (row count, max ID) of the table the index reflects,
+    adjusted on each add & remove, so that changes made elsewhere can be
+    detected by comparing it with the table.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signatures = {}  # question ID -> signature
+        self._answers = {}     # question ID -> answer words
+        self._bands = {}       # (band, hash) -> {question ID}
+        self.version = None    # (row count, max ID), None until loaded
+
+    @staticmethod
+    def _band_keys(sig):
+        rows = NUM_PERM // NUM_BANDS
+        return [(b, hash(sig[b * rows:(b + 1) * rows]))
+                for b in range(NUM_BANDS)]
+
+    def load(self, rows, version=None):
+        """Rebuilds the index from (id, question, answer) rows."""
+        with self._lock:
+            self._signatures = {}
+            self._answers = {}
+            self._bands = {}
+            for qid, question, answer in rows:
+                self._add(qid, signature(question), answer_words(answer))
+            self.version = version
+
+    def add(self, qid, question, answer):
+        sig = signature(question)
+        words = answer_words(answer)
+        with self._lock:
+            if self.version is not None and qid not in self._signatures:
+                count, max_id = self.version
+                self.version = (count + 1, max(max_id or 0, qid))
+            self._add(qid, sig, words)
+
+    def remove(self, qid):
+        with self._lock:
+            if self.version is not None and qid in self._signatures:
+                count, max_id = self.version
+                self.version = (count - 1, max_id)
+            self._remove(qid)
+
+    def _add(self, qid, sig, words):
+        if qid in self._signatures:
+            self._remove(qid)
+        self._signatures[qid] = sig
+        self._answers[qid] = words
+        for key in self._band_keys(sig):
+            self._bands.setdefault(key, set()).add(qid)
+
+    def _remove(self, qid):
+        sig = self._signatures.pop(qid, None)
+        if sig is None:
+            return
+        del self._answers[qid]
+        for key in self._band_keys(sig):
+            band = self._bands[key]
+            band.discard(qid)
+            if not band:
+                del self._bands[key]
+
+    def _matches(self, sig, words, threshold):
+        candidates = set()
+        for key in self._band_keys(sig):
+            candidates |= self._bands.get(key, set())
+
+        matches = []
+        for qid in candidates:
+            score = similarity(sig, self._signatures[qid])
+            if (score >= threshold and answer_similarity(
+                    words, self._answers[qid]) >= ANSWER_THRESHOLD):
+                matches.append((qid, score))
+        return sorted(matches, key=lambda m: (-m[1], m[0]))
+
+    def query(self, question, answer, threshold=DUPLICATE_THRESHOLD):
+        """Finds near-duplicates of a question & answer pair.
+
+        Args:
+          question: (str) Question text
+          answer: (str) Answer text
+          threshold: (float) Minimum estimated Jaccard similarity of questions
+
+        Returns:
+          A list of (question ID, question similarity) pairs, most similar
+          first.
+        """
+        sig = signature(question)
+        words = answer_words(answer)
+        with self._lock:
+            return self._matches(sig, words, threshold)
+
+    def clusters(self, threshold=DUPLICATE_THRESHOLD):
+        """Groups all indexed questions into near-duplicate clusters.
+
+        Returns:
+          A list of sorted question ID lists, each with at least two IDs.
+        """
+        with self._lock:
+            parent = {qid: qid for qid in self._signatures}
+
+            def find(qid):
+                while parent[qid] != qid:
+                    parent[qid] = parent[parent[qid]]
+                    qid = parent[qid]
+                return qid
+
+            for qid, sig in self._signatures.items():
+                words = self._answers[qid]
+                for other, _ in self._matches(sig, words, threshold):
+                    parent[find(other)] = find(qid)
+
+            groups = {}
+            for qid in self._signatures:
+                groups.setdefault(find(qid), []).append(qid)
+
+        return sorted(sorted(g) for g in groups.values() if len(g) > 1)
@@ -4,14 +4,21 @@ import unittest
 
 from flask_sqlalchemy import SQLAlchemy
 
+from find_duplicates import find_duplicates
 from flaskr import create_app, QUESTIONS_PER_PAGE
+from flaskr.admission import AdmissionController
+from flaskr.similarity import SimilarityIndex
 from models import setup_db, Question, Category
 
 
 ERROR_400 = {"success": False, "error": 400, "message": "bad request"}
 ERROR_404 = {"success": False, "error": 404, "message": "resource not found"}
+ERROR_409 = {"success": False, "error": 409, "message": "conflict"}
 ERROR_422 = {"success": False, "error": 422, "message": "unprocessable"}
+ERROR_429 = {"success": False, "error": 429, "message": "too many requests"}
 ERROR_500 = {"success": False, "error": 500, "message": "server error"}
+ERROR_503 = {"success": False, "error": 503,
+             "message": "service unavailable"}
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -260,6 +267,109 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post("/questions", json={})
         self.compare(res, 400, ERROR_400)
 
+    # Endpoint: /questions
+    #  Methods: POST
+    def testCreateQuestionError409(self):
+        q = Question.query.order_by(Question.id).first()
+        if q is None:
+            return
+
+        inputs = {
+            "question": q.question.upper(),
+            "answer": f"{q.answer}.",
+            "category": q.category,
+            "difficulty": q.difficulty,
+        }
+        res = self.client().post("/questions", json=inputs)
+        data = self.validate_response(
+            res, 409, {"success": bool, "error": int, "message": str,
+                       "duplicates": list})
+        self.assertDictEqual({k: data[k] for k in ERROR_409}, ERROR_409)
+        self.assertIn(q.id, data["duplicates"])
+
+    # Endpoint: /questions
+    #  Methods: POST, DELETE
+    def testCreateQuestionAllowDuplicate(self):
+        q = Question.query.order_by(Question.id).first()
+        if q is None:
+            return
+
+        inputs = {
+            "question": q.question,
+            "answer": q.answer,
+            "category": q.category,
+            "difficulty": q.difficulty,
+            "allow_duplicate": True,
+        }
+        res = self.client().post("/questions", json=inputs)
+        data = self.validate_response(
+            res, 200, {"success": bool, "id": int, "duplicates": list})
+        try:
+            self.assertIn(q.id, data["duplicates"])
+        finally:
+            self.client().delete(f"/questions/{data['id']}")
+
+    # Endpoint: /questions
+    #  Methods: POST, DELETE
+    def testCreateQuestionSimilarStem(self):
+        inputs = {
+            "question": "Which country won the first ever soccer World Cup "
+                        "in 1930?",
+            "answer": "Uruguay",
+            "category": 6,
+            "difficulty": 4,
+            "allow_duplicate": True,
+        }
+        r1 = self.client().post("/questions", json=inputs)
+        qid1 = r1.json["id"]
+        try:
+            # Same stem, different answer: not a duplicate.
+            inputs["question"] = inputs["question"].replace("1930", "1934")
+            inputs["answer"] = "Italy"
+            del inputs["allow_duplicate"]
+            r2 = self.client().post("/questions", json=inputs)
+            data = self.validate_response(
+                r2, 200, {"success": bool, "id": int})
+            self.client().delete(f"/questions/{data['id']}")
+        finally:
+            self.client().delete(f"/questions/{qid1}")
+
+    # Endpoint: /questions
+    #  Methods: POST, DELETE
+    def testFindDuplicates(self):
+        inputs = {
+            "question": "Which planet is known as the Red Planet?",
+            "answer": "Mars",
+            "category": 1,
+            "difficulty": 1,
+            "allow_duplicate": True,
+        }
+        qids = []
+        try:
+            for text in (inputs["question"], inputs["question"].upper()):
+                inputs["question"] = text
+                res = self.client().post("/questions", json=inputs)
+                qids.append(res.json["id"])
+
+            clusters = [{q["id"] for q in c} for c in find_duplicates()]
+            self.assertTrue(any(set(qids) <= c for c in clusters))
+        finally:
+            for qid in qids:
+                self.client().delete(f"/questions/{qid}")
+
+    # Endpoint: /questions
+    #  Methods: POST
+    def testCreateQuestionAllowDuplicateError400(self):
+        inputs = {
+            "question": "Strict Boolean Question",
+            "answer": "Strict Boolean Answer",
+            "category": 1,
+            "difficulty": 1,
+            "allow_duplicate": "false",
+        }
+        res = self.client().post("/questions", json=inputs)
+        self.compare(res, 400, ERROR_400)
+
     # Endpoint: /questions
     #  Methods: POST
     def testCreateQuestionError422(self):
@@ -331,6 +441,135 @@ class TriviaTestCase(unittest.TestCase):
             return
         self.assertNotEqual(rq["id"], q.id)
 
+    # Endpoint: /quizzes
+    #  Methods: POST
+    def testGetQuizQuestionDifficultyRange(self):
+        cid = 0
+        inputs = {
+            "previous_questions": [],
+            "quiz_category": cid,
+            "min_difficulty": 2,
+            "max_difficulty": 3,
+        }
+        res = self.client().post("/quizzes", json=inputs)
+        data = self.validate_response(
+            res, 200, {"success": bool, "question": dict}, allow_none=True)
+        self.assertEqual(data["success"], True)
+        rq = data["question"]
+        if rq is None:
+            return
+        self.assertIn(rq["difficulty"], (2, 3))
+
+    # Endpoint: /quizzes
+    #  Methods: POST
+    def testGetQuizQuestionRamp(self):
+        cid = 1
+        query = Question.query.filter(Question.category == cid)
+        easiest = min(q.difficulty for q in query)
+        inputs = {
+            "previous_questions": [],
+            "quiz_category": cid,
+            "ramp": True,
+        }
+        res = self.client().post("/quizzes", json=inputs)
+        data = self.validate_response(
+            res, 200, {"success": bool, "question": dict})
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["question"]["difficulty"], easiest)
+
+    # Endpoint: /quizzes
+    #  Methods: POST
+    def testGetQuizQuestionSkipsStaleBuckets(self):
+        cid = 1
+        qids = []
+        for text in ("Stale bucket question alpha", "Kept bucket query beta"):
+            inputs = {
+                "question": text,
+                "answer": text[::-1],
+                "category": cid,
+                "difficulty": 1,
+            }
+            res = self.client().post("/questions", json=inputs)
+            qids.append(res.json["id"])
+        stale, kept = qids
+
+        try:
+            # Delete behind the app's back, leaving a stale bucket entry.
+            Question.query.get(stale).delete()
+            others = [q.id for q in
+                      Question.query.filter(Question.category == cid)
+                      if q.id != kept]
+            inputs = {"previous_questions": others, "quiz_category": cid}
+            for _ in range(10):
+                res = self.client().post("/quizzes", json=inputs)
+                data = self.validate_response(
+                    res, 200, {"success": bool, "question": dict})
+                self.assertEqual(data["question"]["id"], kept)
+        finally:
+            for qid in qids:
+                q = Question.query.get(qid)
+                if q:
+                    q.delete()
+
+    # Endpoint: /quizzes
+    #  Methods: POST
+    def testGetQuizQuestionNullDifficulty(self):
+        cid = 1
+        q = Question("Null difficulty question", "None", cid, None)
+        q.insert()
+        qid = q.id
+        try:
+            others = [o.id for o in
+                      Question.query.filter(Question.category == cid)
+                      if o.id != qid]
+
+            # Unfiltered quizzes still serve the question.
+            inputs = {"previous_questions": others, "quiz_category": cid}
+            res = self.client().post("/quizzes", json=inputs)
+            data = self.validate_response(
+                res, 200, {"success": bool, "question": dict})
+            self.assertEqual(data["question"]["id"], qid)
+
+            # Filtered & ramped quizzes skip it.
+            for extra in ({"min_difficulty": 1}, {"ramp": True}):
+                for c in (cid, 0):
+                    inputs = {"previous_questions": [],
+                              "quiz_category": c, **extra}
+                    res = self.client().post("/quizzes", json=inputs)
+                    data = self.validate_response(
+                        res, 200, {"success": bool, "question": dict},
+                        allow_none=True)
+                    if data["question"] is not None:
+                        self.assertIsNotNone(
+                            data["question"]["difficulty"])
+        finally:
+            q = Question.query.get(qid)
+            if q:
+                q.delete()
+
+    # Endpoint: /quizzes
+    #  Methods: POST
+    def testGetQuizQuestionRampError400(self):
+        inputs = {
+            "previous_questions": [],
+            "quiz_category": 0,
+            "ramp": "false",
+        }
+        res = self.client().post("/quizzes", json=inputs)
+        self.compare(res, 400, ERROR_400)
+
+    # Endpoint: /quizzes
+    #  Methods: POST
+    def testGetQuizQuestionDifficultyError422(self):
+        inputs = {
+            "previous_questions": [],
+            "quiz_category": 0,
+            "min_difficulty": 4,
+            "max_difficulty": 2,
+        }
+        res = self.client().post("/quizzes", json=inputs)
+        self.compare(res, 422, ERROR_422)
+
     # Endpoint: /quizzes
     #  Methods: POST
     def testGetQuizQuestionError400(self):
@@ -345,11 +584,106 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post("/quizzes", json=inputs)
         self.compare(res, 422, ERROR_422)
 
+    # Endpoint: /categories
+    #  Methods: GET
+    def testRateLimitError429(self):
+        # Freeze the clock so that tokens are never refilled.
+        client = create_app({"ADMISSION_CLIENT_BURST": 3,
+                             "ADMISSION_CLOCK": lambda: 0.0}).test_client
+        for _ in range(3):
+            res = client().get("/categories")
+            self.assertEqual(res.status_code, 200)
+
+        res = client().get("/categories")
+        self.compare(res, 429, ERROR_429)
+        self.assertGreaterEqual(int(res.headers["Retry-After"]), 1)
+
+    # Endpoint: /categories
+    #  Methods: GET
+    def testInFlightLimitError503(self):
+        client = create_app({"ADMISSION_LIMIT": 0}).test_client
+        res = client().get("/categories")
+        self.compare(res, 503, ERROR_503)
+        self.assertEqual(res.headers["Retry-After"], "1")
+
+    # Endpoint: /questions
+    #  Methods: GET
+    def testExpensiveLimitError503(self):
+        client = create_app({"ADMISSION_EXPENSIVE_LIMIT": 0}).test_client
+        self.compare(client().get("/questions"), 503, ERROR_503)
+        self.compare(client().get("/questions?search=w&page=1"),
+                     503, ERROR_503)
+        res = client().get("/questions?page=1")
+        self.assertEqual(res.status_code, 200)
+
+    # Endpoint: /categories
+    #  Methods: GET
+    def testRateLimitPerForwardedClient(self):
+        client = create_app({"ADMISSION_CLIENT_BURST": 1,
+                             "ADMISSION_CLOCK": lambda: 0.0,
+                             "TRUSTED_PROXIES": 1}).test_client
+        for addr in ("10.0.0.1", "10.0.0.2"):
+            res = client().get("/categories",
+                               headers={"X-Forwarded-For": addr})
+            self.assertEqual(res.status_code, 200)
+
+        res = client().get("/categories",
+                           headers={"X-Forwarded-For": "10.0.0.1"})
+        self.compare(res, 429, ERROR_429)
+
     def tearDown(self):
         """Executed after each test"""
         pass
 
 
+class SimilarityIndexTestCase(unittest.TestCase):
+    """This class represents the near-duplicate index test case"""
+
+    def testClusters(self):
+        index = SimilarityIndex()
+        index.load([
+            (1, "What is the largest planet in our solar system?", "Jupiter"),
+            (2, "What is the largest planet in the solar system?", "Jupiter"),
+            (3, "What is the smallest planet in our solar system?", "Mercury"),
+            (4, "Who discovered penicillin?", "Alexander Fleming"),
+            (5, None, None),
+        ])
+        self.assertListEqual(index.clusters(), [[1, 2]])
+
+        index.remove(2)
+        self.assertListEqual(index.clusters(), [])
+
+
+class AdmissionControllerTestCase(unittest.TestCase):
+    """This class represents the admission controller test case"""
+
+    def testAdmissionInFlight(self):
+        admission = AdmissionController(3, expensive_limit=1)
+        self.assertIsNone(admission.admit("a", expensive=True))
+        self.assertEqual(admission.admit("b", expensive=True), (503, 1))
+        self.assertIsNone(admission.admit("b"))
+        self.assertIsNone(admission.admit("c"))
+        self.assertEqual(admission.admit("d"), (503, 1))
+
+        admission.release(expensive=True)
+        self.assertIsNone(admission.admit("d", expensive=True))
+
+    def testAdmissionEvictsLeastRecentlyUsed(self):
+        admission = AdmissionController(
+            10, rate=1, burst=1, max_clients=2, clock=lambda: 0.0)
+        self.assertIsNone(admission.admit("a"))
+        admission.release()
+        self.assertIsNone(admission.admit("b"))
+        admission.release()
+        self.assertEqual(admission.admit("a"), (429, 1))  # Uses "a" last
+
+        # "b" is evicted for "c", so only "a" stays limited.
+        self.assertIsNone(admission.admit("c"))
+        admission.release()
+        self.assertEqual(admission.admit("a"), (429, 1))
+        self.assertIsNone(admission.admit("b"))
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()